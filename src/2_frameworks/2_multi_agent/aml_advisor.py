@@ -21,31 +21,42 @@ Architecture:
 import argparse
 import asyncio
 import contextlib
-import json
-import sys
+import functools
+import hashlib
+import logging
+import os
+import signal
+import time
 from enum import Enum
 from pathlib import Path
-from typing import Any
+from types import MappingProxyType
+from typing import Any, AsyncIterator, Iterator, Mapping
 
 import agents
+import msgspec
 import openai
 import pydantic
 from dotenv import load_dotenv
+from weaviate import WeaviateAsyncClient
 
 from src.utils import (
+    AsyncTTLCache,
     AsyncWeaviateKnowledgeBase,
     Configs,
+    SemanticCache,
     get_weaviate_async_client,
     set_up_logging,
     setup_langfuse_tracer,
 )
-from src.utils.async_utils import gather_with_progress, rate_limited
-from src.utils.langfuse.shared_client import langfuse_client
+from src.utils.async_utils import rate_limited
+from src.utils.langfuse.shared_client import flush_langfuse, langfuse_client
 
 
 # Load environment variables
 load_dotenv(verbose=True)
 
+logger = logging.getLogger(__name__)
+
 
 class AMLCategory(str, Enum):
     """AML advisory categories."""
@@ -57,15 +68,48 @@ class AMLCategory(str, Enum):
     SCENARIO_TESTING = "scenario_testing"
 
 
+# Display strings per category, precomputed once for logs, spans and reports
+_CATEGORY_LABELS: dict[AMLCategory, str] = {c: c.value for c in AMLCategory}
+_CATEGORY_TITLES: dict[AMLCategory, str] = {
+    c: c.value.replace("_", " ").title() for c in AMLCategory
+}
+
+
 # Model configuration
 AGENT_LLM_NAMES = {
     "router": "gemini-2.5-flash",
     "specialist": "gemini-2.5-pro",
     "synthesizer": "gemini-2.5-pro",
+    "refiner": "gemini-2.5-flash",
 }
 
-MAX_CONCURRENCY = {"specialist": 3, "synthesizer": 1}
-MAX_GENERATED_TOKENS = {"router": 8192, "specialist": 32768, "synthesizer": 32768}
+# Flush Langfuse once before `main` returns so queued traces are not lost
+LANGFUSE_ENFORCE_FLUSH = (
+    os.getenv("AML_LANGFUSE_ENFORCE_FLUSH", "true").lower() == "true"
+)
+
+# Upper bound on specialists consulted per query
+MAX_SPECIALISTS = 3
+MAX_CONCURRENCY = {"specialist": 3, "synthesizer": 1, "document_io": 32}
+# Thinking tokens count against `max_tokens`; the router does not think, so
+# its budget only has to fit the QueryRouting JSON.
+MAX_GENERATED_TOKENS = {
+    "router": 1024,
+    "specialist": 32768,
+    "synthesizer": 32768,
+    "refiner": 16384,
+}
+
+# File types picked up by `load_documents`
+DOCUMENT_SUFFIXES = {".txt", ".json", ".md"}
+
+# Opt-in reuse of advice for similar queries (or pass --semantic_cache).
+# Queries and advice are stored in plain text at SEMANTIC_CACHE_PATH.
+SEMANTIC_CACHE_ENABLED = os.getenv("AML_SEMANTIC_CACHE", "false").lower() == "true"
+# Cosine similarity above which a previous query's advice is reused
+SEMANTIC_CACHE_THRESHOLD = 0.93
+SEMANTIC_CACHE_PATH = Path(".aml_semantic_cache.json")
+SEMANTIC_CACHE_TTL = 24 * 3600
 
 # Knowledge base collection names for different AML domains
 # You can customize these based on your Weaviate collections
@@ -78,13 +122,17 @@ KNOWLEDGE_BASE_COLLECTIONS = {
 }
 
 
-class Document(pydantic.BaseModel):
-    """AML document structure."""
+class Document(msgspec.Struct, frozen=True):
+    """AML document structure.
+
+    Only built internally from local files, so this is a msgspec Struct rather
+    than a Pydantic model to avoid per-field validation on load.
+    """
 
     filename: str
     content: str
     document_type: str | None = None
-    metadata: dict[str, Any] = pydantic.Field(default_factory=dict)
+    metadata: dict[str, Any] = msgspec.field(default_factory=dict)
 
 
 class QueryRouting(pydantic.BaseModel):
@@ -153,6 +201,14 @@ class SynthesizedAdvice(pydantic.BaseModel):
     specialist_analyses: list[SpecialistAnalysis]
 
 
+# Output schemas built once. Given a bare model class, the SDK rebuilds the
+# pydantic TypeAdapter and strict JSON schema on every run; an instance is
+# reused as is, and responses are still validated by pydantic-core's parser.
+ROUTING_SCHEMA = agents.AgentOutputSchema(QueryRouting)
+ANALYSIS_SCHEMA = agents.AgentOutputSchema(SpecialistAnalysis)
+ADVICE_SCHEMA = agents.AgentOutputSchema(SynthesizedAdvice)
+
+
 # Initialize clients
 configs = Configs.from_env_var()
 async_weaviate_client = get_weaviate_async_client(
@@ -166,28 +222,74 @@ async_weaviate_client = get_weaviate_async_client(
 )
 async_openai_client = openai.AsyncOpenAI()
 
-# Initialize knowledge bases for each AML category
-knowledge_bases: dict[AMLCategory, AsyncWeaviateKnowledgeBase] = {}
-for category, collection_name in KNOWLEDGE_BASE_COLLECTIONS.items():
-    knowledge_bases[category] = AsyncWeaviateKnowledgeBase(
-        async_weaviate_client,
+
+def _make_kb(
+    client: WeaviateAsyncClient, collection_name: str
+) -> AsyncWeaviateKnowledgeBase:
+    """Build a knowledge base over one collection with the advisor's settings."""
+    return AsyncWeaviateKnowledgeBase(
+        client,
         collection_name=collection_name,
         num_results=5,  # Number of search results per query
         snippet_length=1000,  # Length of text snippets
     )
 
 
+def build_knowledge_bases(
+    client: WeaviateAsyncClient, overrides: dict[AMLCategory, str] | None = None
+) -> dict[AMLCategory, AsyncWeaviateKnowledgeBase]:
+    """Build one knowledge base per AML category, applying collection overrides."""
+    collections = {**KNOWLEDGE_BASE_COLLECTIONS, **(overrides or {})}
+    return {
+        category: _make_kb(client, collection_name)
+        for category, collection_name in collections.items()
+    }
+
+
+# Knowledge bases for each AML category, populated lazily by `main`
+knowledge_bases: dict[AMLCategory, AsyncWeaviateKnowledgeBase] = {}
+
+# Shared across specialists so overlapping searches skip the Weaviate round-trip
+search_cache = AsyncTTLCache(ttl=300, max_size=2000)
+
+# Whole-session cache of (routing, advice) keyed on the user query's embedding.
+# Created by `_get_semantic_cache` only when the cache is enabled.
+semantic_cache: SemanticCache | None = None
+
+
+def _get_semantic_cache() -> SemanticCache:
+    """Return the semantic cache, loading it from disk on first use."""
+    global semantic_cache  # noqa: PLW0603
+    if semantic_cache is None:
+        semantic_cache = SemanticCache(path=SEMANTIC_CACHE_PATH, ttl=SEMANTIC_CACHE_TTL)
+    return semantic_cache
+
+
+_clients_closed = False
+
+
 async def _cleanup_clients() -> None:
-    """Close async clients."""
-    await async_weaviate_client.close()
-    await async_openai_client.close()
+    """Close async clients. Safe to call more than once.
 
+    Each client is closed independently so one failure does not leak the rest.
+    """
+    global _clients_closed  # noqa: PLW0603
+    if _clients_closed:
+        return
+    _clients_closed = True
 
-def _handle_sigint(signum: int, frame: object) -> None:
-    """Handle SIGINT signal to gracefully shutdown."""
     with contextlib.suppress(Exception):
-        asyncio.get_event_loop().run_until_complete(_cleanup_clients())
-    sys.exit(0)
+        await async_weaviate_client.close()
+    with contextlib.suppress(Exception):
+        await async_openai_client.close()
+    if semantic_cache is not None:
+        with contextlib.suppress(Exception):
+            await semantic_cache.close()
+
+
+def _dumps(obj: Any) -> str:
+    """Serialize agent input to indented JSON using msgspec."""
+    return msgspec.json.format(msgspec.json.encode(obj), indent=2).decode()
 
 
 # Router Agent
@@ -206,24 +308,25 @@ router_agent = agents.Agent(
     - scenario_testing: Hypothetical scenario analysis and guidance
     
     Be thorough in identifying all relevant categories.""",
-    output_type=QueryRouting,
+    # `output_type` makes the SDK request a strict JSON-schema response format,
+    # so generation is already constrained to the QueryRouting schema.
+    output_type=ROUTING_SCHEMA,
     model=agents.OpenAIChatCompletionsModel(
         model=AGENT_LLM_NAMES["router"], openai_client=async_openai_client
     ),
+    # The router is the cheap classifier in front of the expensive specialists.
+    # Gemini 2.5 models think by default when no effort is sent, so turn it off
+    # explicitly. "none" is not in the SDK's effort literal, hence `extra_body`.
     model_settings=agents.ModelSettings(
+        extra_body={"reasoning_effort": "none"},
         max_tokens=MAX_GENERATED_TOKENS["router"],
     ),
 )
 
 
-# Specialist Agents
-def create_specialist_agent(
-    category: AMLCategory, knowledge_base: AsyncWeaviateKnowledgeBase
-) -> agents.Agent:
-    """Create a specialist agent for a specific AML category with knowledge base access."""
-
-    instructions_map = {
-        AMLCategory.CDD_RED_FLAGS: """You are an expert in Customer Due Diligence (CDD) and KYC (Know Your Customer).
+# Specialist instructions per category, shared by every specialist agent build
+_SPECIALIST_INSTRUCTIONS: Mapping[AMLCategory, str] = MappingProxyType({
+    AMLCategory.CDD_RED_FLAGS: """You are an expert in Customer Due Diligence (CDD) and KYC (Know Your Customer).
         Analyze the provided documents and query to identify:
         - Red flags and suspicious indicators
         - Risk classification factors
@@ -232,7 +335,7 @@ def create_specialist_agent(
         - Best practices for customer verification
         
         Provide specific, actionable insights based on current AML standards.""",
-        AMLCategory.REGULATORY_UPDATES: """You are an expert in AML regulatory compliance.
+    AMLCategory.REGULATORY_UPDATES: """You are an expert in AML regulatory compliance.
         Analyze the provided documents and query to identify:
         - Recent regulatory changes and updates
         - Impact on current processes
@@ -241,7 +344,7 @@ def create_specialist_agent(
         - Jurisdictional considerations
         
         Reference specific regulations (e.g., BSA, FinCEN, FATF guidelines).""",
-        AMLCategory.SAR_FILING: """You are an expert in Suspicious Activity Report (SAR) filing.
+    AMLCategory.SAR_FILING: """You are an expert in Suspicious Activity Report (SAR) filing.
         Analyze the provided information to help draft a SAR that:
         - Clearly describes suspicious activity
         - Includes all required elements
@@ -250,7 +353,7 @@ def create_specialist_agent(
         - Maintains confidentiality requirements
         
         Follow FinCEN SAR guidelines and best practices.""",
-        AMLCategory.POLICY_REVIEW: """You are an expert in AML policy development and review.
+    AMLCategory.POLICY_REVIEW: """You are an expert in AML policy development and review.
         Analyze the provided policy documents to:
         - Identify gaps and weaknesses
         - Compare against industry standards
@@ -259,7 +362,7 @@ def create_specialist_agent(
         - Suggest implementation strategies
         
         Reference FATF recommendations and industry best practices.""",
-        AMLCategory.SCENARIO_TESTING: """You are an expert in AML scenario analysis and testing.
+    AMLCategory.SCENARIO_TESTING: """You are an expert in AML scenario analysis and testing.
         Analyze the provided scenario to:
         - Assess risk levels
         - Recommend appropriate actions
@@ -268,18 +371,48 @@ def create_specialist_agent(
         - Consider regulatory obligations
         
         Provide step-by-step guidance for handling the scenario.""",
-    }
+})
+
+
+# Specialist Agents
+def create_specialist_agent(
+    category: AMLCategory, knowledge_base: AsyncWeaviateKnowledgeBase
+) -> agents.Agent:
+    """Create a specialist agent for a specific AML category with knowledge base access."""
+
+    collection_name = knowledge_base.collection_name
+    num_results = knowledge_base.num_results
+    cached_search = search_cache.wrap(
+        knowledge_base.search_knowledgebase,
+        key_fn=lambda keyword: (collection_name, keyword.strip().lower(), num_results),
+    )
+
+    @functools.wraps(knowledge_base.search_batch)
+    async def cached_search_batch(queries: list[str]) -> list[Any]:
+        return list(await asyncio.gather(*(cached_search(q) for q in queries)))
+
+    search_tool_name = f"search_{category.value}"
+    instructions = (
+        f"{_SPECIALIST_INSTRUCTIONS[category]}\n\n"
+        f"If you have multiple related sub-queries, call `{search_tool_name}_batch` "
+        f"once instead of calling `{search_tool_name}` repeatedly."
+    )
 
     return agents.Agent(
         f"AML Specialist: {category.value}",
-        instructions=instructions_map[category],
-        output_type=SpecialistAnalysis,
+        instructions=instructions,
+        output_type=ANALYSIS_SCHEMA,
         tools=[
             agents.function_tool(
-                knowledge_base.search_knowledgebase,
-                tool_name=f"search_{category.value}",
+                cached_search,
+                tool_name=search_tool_name,
                 tool_description=f"Search the {category.value.replace('_', ' ')} knowledge base for relevant AML information, regulations, guidelines, and best practices.",
-            )
+            ),
+            agents.function_tool(
+                cached_search_batch,
+                tool_name=f"{search_tool_name}_batch",
+                tool_description=f"Search the {category.value.replace('_', ' ')} knowledge base with several queries at once. Returns one list of results per query.",
+            ),
         ],
         model=agents.OpenAIChatCompletionsModel(
             model=AGENT_LLM_NAMES["specialist"], openai_client=async_openai_client
@@ -293,6 +426,23 @@ def create_specialist_agent(
     )
 
 
+# Specialist agents are memoized per (category, knowledge base) so that each
+# consultation reuses the same Agent, model and tool wrappers.
+_specialist_agents: dict[tuple[AMLCategory, int], agents.Agent] = {}
+
+
+def get_specialist_agent(
+    category: AMLCategory, knowledge_base: AsyncWeaviateKnowledgeBase
+) -> agents.Agent:
+    """Return the cached specialist agent for a category, building it on a miss."""
+    key = (category, id(knowledge_base))
+    specialist = _specialist_agents.get(key)
+    if specialist is None:
+        specialist = create_specialist_agent(category, knowledge_base)
+        _specialist_agents[key] = specialist
+    return specialist
+
+
 # Synthesis Agent
 synthesis_agent = agents.Agent(
     "AML Advisory Synthesizer",
@@ -310,8 +460,11 @@ synthesis_agent = agents.Agent(
     - Risk-based and proportionate
     - Clear and well-structured
     
-    Highlight any conflicting recommendations and provide guidance on resolution.""",
-    output_type=SynthesizedAdvice,
+    Highlight any conflicting recommendations and provide guidance on resolution.
+
+    If the input is marked "partial", other specialists are still working; base the
+    advice on the analyses provided.""",
+    output_type=ADVICE_SCHEMA,
     model=agents.OpenAIChatCompletionsModel(
         model=AGENT_LLM_NAMES["synthesizer"], openai_client=async_openai_client
     ),
@@ -321,156 +474,441 @@ synthesis_agent = agents.Agent(
     ),
 )
 
+# Refines a synthesis drafted while specialists were still running. This is the
+# only step left after the last specialist reports, so it uses the fast model.
+refinement_agent = agents.Agent(
+    "AML Advisory Refiner",
+    instructions="""You are a senior AML compliance advisor. You are given a
+    "draft_synthesis" written before all specialist analyses were available, and
+    the complete "specialist_analyses".
+
+    Update the draft so that it covers every specialist analysis: fold in new
+    findings, recommendations, risks and checklist items, resolve conflicts, and
+    keep everything in the draft that is still correct. Do not start from scratch.""",
+    output_type=ADVICE_SCHEMA,
+    model=agents.OpenAIChatCompletionsModel(
+        model=AGENT_LLM_NAMES["refiner"], openai_client=async_openai_client
+    ),
+    model_settings=agents.ModelSettings(
+        reasoning=openai.types.Reasoning(effort="low"),
+        max_tokens=MAX_GENERATED_TOKENS["refiner"],
+    ),
+)
+
+
+# Span updates serialize full agent inputs/outputs, so they are queued here and
+# applied (and the spans ended) by `_drain_trace_queue` off the critical path.
+_trace_queue: asyncio.Queue[tuple[Any, dict[str, Any], int]] = asyncio.Queue()
+
+
+def _defer_span_update(span: Any, **update: Any) -> None:
+    """Queue `span.update(**update)` and end the span with the current time."""
+    _trace_queue.put_nowait((span, update, time.time_ns()))
+
+
+def _apply_span_update(span: Any, update: dict[str, Any], end_time: int) -> None:
+    """Apply a queued span update and end the span."""
+    if update:
+        span.update(**update)
+    span.end(end_time=end_time)
+
+
+async def _drain_trace_queue() -> None:
+    """Apply queued span updates in a worker thread until cancelled."""
+    while True:
+        span, update, end_time = await _trace_queue.get()
+        try:
+            await asyncio.to_thread(_apply_span_update, span, update, end_time)
+        except Exception as e:
+            logger.warning(f"Trace update error: {e}")
+        finally:
+            _trace_queue.task_done()
+
+
+async def _finish_traces(trace_consumer: "asyncio.Task[None]") -> None:
+    """Apply outstanding span updates, stop the consumer and flush traces once."""
+    await _trace_queue.join()
+    trace_consumer.cancel()
+    if LANGFUSE_ENFORCE_FLUSH:
+        flush_langfuse()
+
 
 async def route_query(user_query: str) -> QueryRouting:
     """Route the user query to appropriate specialist categories."""
-    with langfuse_client.start_as_current_observation(name="Route Query") as span:
+    with langfuse_client.start_as_current_observation(
+        name="Route Query", end_on_exit=False
+    ) as span:
+        span_update: dict[str, Any] = {"input": user_query}
         try:
             result = await agents.Runner.run(router_agent, input=user_query)
             routing = result.final_output_as(QueryRouting)
-            span.update(input=user_query, output=routing)
+            span_update["output"] = routing
             return routing
         except agents.AgentsException as e:
             print(f"Routing error: {e}")
             raise
+        finally:
+            _defer_span_update(span, **span_update)
 
 
 async def analyze_with_specialist(
-    category: AMLCategory, user_query: str, documents: list[Document], key_aspects: list[str]
+    category: AMLCategory,
+    user_query: str,
+    doc_payload: list[dict[str, Any]],
+    key_aspects: list[str],
 ) -> SpecialistAnalysis | None:
-    """Get analysis from a specialist agent with knowledge base access."""
+    """Get analysis from a specialist agent with knowledge base access.
+
+    `doc_payload` is the already-truncated document list built once by
+    `stream_specialists` and shared by every specialist.
+    """
     knowledge_base = knowledge_bases.get(category)
     if not knowledge_base:
-        print(f"Warning: No knowledge base configured for {category.value}")
+        print(
+            f"Warning: No knowledge base configured for {_CATEGORY_LABELS[category]}"
+        )
         # Create a basic knowledge base with default collection if not configured
         knowledge_base = AsyncWeaviateKnowledgeBase(
             async_weaviate_client,
             collection_name="enwiki_20250520",  # Fallback to default collection
         )
     
-    specialist = create_specialist_agent(category, knowledge_base)
+    specialist = get_specialist_agent(category, knowledge_base)
 
     # Prepare context
     context = {
         "query": user_query,
         "key_aspects": key_aspects,
-        "documents": [
-            {
-                "filename": doc.filename,
-                "content": doc.content[:5000],  # Limit content length
-                "type": doc.document_type,
-            }
-            for doc in documents
-        ],
+        "documents": doc_payload,
     }
 
     with langfuse_client.start_as_current_observation(
-        name=f"Specialist Analysis: {category.value}"
+        name=f"Specialist Analysis: {_CATEGORY_LABELS[category]}", end_on_exit=False
     ) as span:
+        span_update: dict[str, Any] = {"input": context}
         try:
             result = await agents.Runner.run(
-                specialist, input=json.dumps(context, indent=2)
+                specialist, input=_dumps(context)
             )
             analysis = result.final_output_as(SpecialistAnalysis)
-            analysis.category = category
-            span.update(input=context, output=analysis)
+            # Internal trust: the LLM output was validated above and `category`
+            # is our own enum member, so update without re-validating.
+            analysis = analysis.model_copy(update={"category": category})
+            span_update["output"] = analysis
+            span_update["metadata"] = {"search_cache": search_cache.stats()}
             return analysis
         except agents.AgentsException as e:
-            print(f"Specialist error ({category.value}): {e}")
+            print(f"Specialist error ({_CATEGORY_LABELS[category]}): {e}")
             return None
+        finally:
+            _defer_span_update(span, **span_update)
+
+
+def select_categories(routing: QueryRouting) -> list[AMLCategory]:
+    """Return routed categories, primary first, deduplicated and capped."""
+    categories = list(
+        dict.fromkeys([routing.primary_category, *routing.secondary_categories])
+    )
+    return categories[:MAX_SPECIALISTS]
 
 
-async def process_specialists(
+async def stream_specialists(
     routing: QueryRouting, user_query: str, documents: list[Document]
-) -> list[SpecialistAnalysis]:
-    """Process all relevant specialist agents in parallel."""
-    categories = [routing.primary_category] + routing.secondary_categories
+) -> AsyncIterator[SpecialistAnalysis]:
+    """Run the routed specialists in parallel, yielding analyses as they finish."""
+    categories = select_categories(routing)
+    doc_payload = [
+        {
+            "filename": doc.filename,
+            "content": doc.content[:5000],  # Limit content length
+            "type": doc.document_type,
+        }
+        for doc in documents
+    ]
 
     semaphore = asyncio.Semaphore(MAX_CONCURRENCY["specialist"])
-    coros = [
-        rate_limited(
-            lambda cat=cat: analyze_with_specialist(
-                cat, user_query, documents, routing.key_aspects
-            ),
-            semaphore,
+    tasks = [
+        asyncio.create_task(
+            rate_limited(
+                lambda cat=cat: analyze_with_specialist(
+                    cat, user_query, doc_payload, routing.key_aspects
+                ),
+                semaphore,
+            )
         )
         for cat in categories
     ]
 
-    results = await gather_with_progress(coros, "Consulting specialists...")
-    return [r for r in results if r is not None]
+    try:
+        for finished in asyncio.as_completed(tasks):
+            analysis = await finished
+            if analysis is not None:
+                yield analysis
+    finally:
+        # No-op for finished tasks; stops stragglers if the consumer bails out
+        for task in tasks:
+            task.cancel()
 
 
 async def synthesize_advice(
-    user_query: str, routing: QueryRouting, analyses: list[SpecialistAnalysis]
+    user_query: str,
+    routing: QueryRouting,
+    analyses: list[SpecialistAnalysis],
+    dumped_analyses: list[dict[str, Any]] | None = None,
+    partial: bool = False,
+    draft: SynthesizedAdvice | None = None,
 ) -> SynthesizedAdvice:
-    """Synthesize specialist analyses into final advice."""
-    synthesis_input = {
+    """Synthesize specialist analyses into final advice.
+
+    `dumped_analyses` may carry the precomputed `model_dump(mode="json")` of
+    `analyses` so that each analysis is only walked once per session. `partial`
+    marks a synthesis started before all specialists have reported. Given such
+    an earlier synthesis as `draft`, the cheaper `refinement_agent` updates it
+    instead of the synthesizer starting over.
+    """
+    if dumped_analyses is None:
+        dumped_analyses = [a.model_dump(mode="json") for a in analyses]
+
+    synthesis_input: dict[str, Any] = {
         "user_query": user_query,
-        "routing_decision": routing.model_dump(),
-        "specialist_analyses": [a.model_dump() for a in analyses],
+        "routing_decision": routing.model_dump(mode="json"),
+        "specialist_analyses": dumped_analyses,
     }
+    if partial:
+        synthesis_input["partial"] = True
+    if draft is not None:
+        synthesis_input["draft_synthesis"] = draft.model_dump(
+            mode="json", exclude={"specialist_analyses"}
+        )
+
+    if draft is not None:
+        agent, span_name = refinement_agent, "Refine Advice"
+    elif partial:
+        agent, span_name = synthesis_agent, "Synthesize Advice (partial)"
+    else:
+        agent, span_name = synthesis_agent, "Synthesize Advice"
 
-    with langfuse_client.start_as_current_observation(name="Synthesize Advice") as span:
+    with langfuse_client.start_as_current_observation(
+        name=span_name, end_on_exit=False
+    ) as span:
+        span_update: dict[str, Any] = {"input": synthesis_input}
         try:
-            result = await agents.Runner.run(
-                synthesis_agent, input=json.dumps(synthesis_input, indent=2)
-            )
+            result = await agents.Runner.run(agent, input=_dumps(synthesis_input))
             advice = result.final_output_as(SynthesizedAdvice)
-            advice.specialist_analyses = analyses
-            span.update(input=synthesis_input, output=advice)
+            # Internal trust: `analyses` are already-validated models.
+            advice = advice.model_copy(update={"specialist_analyses": analyses})
+            span_update["output"] = advice
             return advice
         except agents.AgentsException as e:
             print(f"Synthesis error: {e}")
             raise
+        finally:
+            _defer_span_update(span, **span_update)
+
+
+def _synthesize_locally(analysis: SpecialistAnalysis) -> SynthesizedAdvice:
+    """Build advice directly from a single specialist analysis, without an LLM."""
+    # Internal trust: every field comes from an already-validated analysis.
+    return SynthesizedAdvice.model_construct(
+        executive_summary=analysis.risk_assessment,
+        detailed_analysis="\n".join(analysis.key_findings),
+        actionable_recommendations=analysis.recommendations,
+        risk_mitigation_strategies=[],
+        compliance_checklist=[],
+        next_steps=[],
+        specialist_analyses=[analysis],
+    )
+
+
+async def synthesize_advice_streaming(
+    user_query: str,
+    routing: QueryRouting,
+    analyses_stream: AsyncIterator[SpecialistAnalysis],
+) -> tuple[SynthesizedAdvice, list[dict[str, Any]]]:
+    """Synthesize advice while specialist analyses are still arriving.
+
+    As soon as the primary analysis lands while other specialists are still
+    running, the expensive synthesis is started on it in the background. Once
+    all analyses are in, that draft is awaited and only refined with the fast
+    model, so the slow synthesis overlaps the remaining specialists instead of
+    following them. If the draft fails, a full synthesis runs instead. When
+    only one analysis arrives, it is turned into advice without the synthesizer.
+
+    Returns the advice together with the JSON dumps of its specialist analyses.
+    """
+    analyses: list[SpecialistAnalysis] = []
+    dumped_analyses: list[dict[str, Any]] = []
+    expected = len(select_categories(routing))
+    draft_task: asyncio.Task[SynthesizedAdvice] | None = None
+
+    async for analysis in analyses_stream:
+        analyses.append(analysis)
+        dumped_analyses.append(analysis.model_dump(mode="json"))
+        print(f"Received analysis: {_CATEGORY_LABELS[analysis.category]}")
+
+        if (
+            draft_task is None
+            and analysis.category == routing.primary_category
+            and len(analyses) < expected
+        ):
+            draft_task = asyncio.create_task(
+                synthesize_advice(
+                    user_query,
+                    routing,
+                    list(analyses),
+                    list(dumped_analyses),
+                    partial=True,
+                )
+            )
+
+    draft = None
+    if draft_task is not None:
+        try:
+            draft = await draft_task
+        except Exception as e:
+            logger.warning(f"Draft synthesis failed, synthesizing from scratch: {e}")
+
+    if len(analyses) == 1:
+        # Nothing to merge, so skip the synthesizer round-trip.
+        return draft or _synthesize_locally(analyses[0]), dumped_analyses
+
+    advice = await synthesize_advice(
+        user_query, routing, analyses, dumped_analyses, draft=draft
+    )
+    return advice, dumped_analyses
+
+
+def _semantic_cache_namespace(documents: list[Document]) -> str:
+    """Return a digest of everything advice depends on besides the query.
+
+    Covers the document set, the resolved knowledge base collections and the
+    model names, so that cached advice is only reused for identical setups.
+    """
+    digest = hashlib.sha256()
+    for doc in documents:
+        digest.update(doc.filename.encode())
+        digest.update(doc.content.encode())
+    for category in AMLCategory:
+        collection_name = knowledge_bases[category].collection_name
+        digest.update(f"{category.value}={collection_name}".encode())
+    for role, model_name in sorted(AGENT_LLM_NAMES.items()):
+        digest.update(f"{role}={model_name}".encode())
+    return digest.hexdigest()
+
+
+async def _lookup_cached_advice(
+    user_query: str, namespace: str
+) -> dict[str, str] | None:
+    """Look up cached advice; cache failures count as a miss."""
+    try:
+        return await _get_semantic_cache().lookup(
+            user_query, threshold=SEMANTIC_CACHE_THRESHOLD, namespace=namespace
+        )
+    except Exception as e:
+        logger.warning(f"Semantic cache lookup failed, running agents: {e}")
+        return None
+
+
+async def _store_cached_advice(
+    user_query: str, payload: dict[str, str], namespace: str
+) -> None:
+    """Store advice in the semantic cache; failures are logged, not raised."""
+    try:
+        await _get_semantic_cache().store(user_query, payload, namespace=namespace)
+    except Exception as e:
+        logger.warning(f"Could not store advice in semantic cache: {e}")
 
 
-def load_documents(documents_dir: Path) -> list[Document]:
-    """Load AML documents from directory."""
-    documents = []
+async def load_documents(documents_dir: Path) -> list[Document]:
+    """Load AML documents from directory.
+
+    Files are discovered in a single directory walk and read concurrently in
+    worker threads, capped by `MAX_CONCURRENCY["document_io"]` open files.
+    """
+    documents: list[Document] = []
 
     if not documents_dir.exists():
         print(f"Warning: Documents directory not found: {documents_dir}")
         return documents
 
-    for file_path in documents_dir.glob("**/*.txt"):
-        try:
-            content = file_path.read_text(encoding="utf-8")
-            documents.append(
-                Document(
-                    filename=file_path.name,
-                    content=content,
-                    document_type=file_path.stem.split("_")[0]
-                    if "_" in file_path.stem
-                    else None,
-                    metadata={"path": str(file_path)},
-                )
+    # os.walk uses scandir's cached entry types, avoiding a stat per entry
+    paths = sorted(
+        Path(dir_path) / filename
+        for dir_path, _, filenames in os.walk(documents_dir)
+        for filename in filenames
+        if os.path.splitext(filename)[1] in DOCUMENT_SUFFIXES
+    )
+
+    semaphore = asyncio.Semaphore(MAX_CONCURRENCY["document_io"])
+    contents = await asyncio.gather(
+        *[
+            rate_limited(
+                lambda file_path=file_path: asyncio.to_thread(
+                    file_path.read_text, encoding="utf-8"
+                ),
+                semaphore,
             )
-        except Exception as e:
-            print(f"Error loading {file_path}: {e}")
-
-    # Also support JSON and MD files
-    for ext in ["*.json", "*.md"]:
-        for file_path in documents_dir.glob(f"**/{ext}"):
-            try:
-                content = file_path.read_text(encoding="utf-8")
-                documents.append(
-                    Document(
-                        filename=file_path.name,
-                        content=content,
-                        document_type=file_path.suffix[1:],
-                        metadata={"path": str(file_path)},
-                    )
-                )
-            except Exception as e:
-                print(f"Error loading {file_path}: {e}")
+            for file_path in paths
+        ],
+        return_exceptions=True,
+    )
+
+    for file_path, content in zip(paths, contents):
+        if isinstance(content, BaseException):
+            print(f"Error loading {file_path}: {content}")
+            continue
+
+        if file_path.suffix == ".txt":
+            document_type = (
+                file_path.stem.split("_")[0] if "_" in file_path.stem else None
+            )
+        else:
+            # JSON and MD files are typed by their extension
+            document_type = file_path.suffix[1:]
+
+        documents.append(
+            Document(
+                file_path.name, content, document_type, {"path": str(file_path)}
+            )
+        )
 
     return documents
 
 
-def generate_report(advice: SynthesizedAdvice, routing: QueryRouting) -> str:
-    """Generate markdown report from synthesized advice."""
-    report = f"""# AML Advisory Report
+NL = "\n"
+
+
+def _bullets(items: list[str], prefix: str = "- ") -> str:
+    """Render items as newline-separated markdown list entries."""
+    return NL.join(f"{prefix}{item}" for item in items)
+
+
+def _numbered(items: list[str]) -> str:
+    """Render items as a newline-separated numbered markdown list."""
+    return NL.join(f"{i + 1}. {item}" for i, item in enumerate(items))
+
+
+def write_report(advice: SynthesizedAdvice, routing: QueryRouting, path: Path) -> None:
+    """Write markdown report from synthesized advice to `path`.
+
+    Sections are written to the file as they are rendered rather than joined
+    into one string first, so the full report is never held in memory twice.
+    """
+    with path.open("w", encoding="utf-8", buffering=1 << 20) as f:
+        for section in _report_sections(advice, routing):
+            f.write(section)
+
+
+def _report_sections(
+    advice: SynthesizedAdvice, routing: QueryRouting
+) -> Iterator[str]:
+    """Yield the markdown report section by section."""
+    secondary_categories = (
+        ", ".join(_CATEGORY_LABELS[c] for c in routing.secondary_categories)
+        if routing.secondary_categories
+        else "None"
+    )
+    yield f"""# AML Advisory Report
 
 ## Executive Summary
 
@@ -480,14 +918,14 @@ def generate_report(advice: SynthesizedAdvice, routing: QueryRouting) -> str:
 
 ## Query Routing
 
-**Primary Category:** {routing.primary_category.value}
+**Primary Category:** {_CATEGORY_LABELS[routing.primary_category]}
 
-**Secondary Categories:** {', '.join(c.value for c in routing.secondary_categories) if routing.secondary_categories else 'None'}
+**Secondary Categories:** {secondary_categories}
 
 **Routing Reasoning:** {routing.reasoning}
 
 **Key Aspects Analyzed:**
-{chr(10).join(f'- {aspect}' for aspect in routing.key_aspects)}
+{_bullets(routing.key_aspects)}
 
 ---
 
@@ -499,25 +937,25 @@ def generate_report(advice: SynthesizedAdvice, routing: QueryRouting) -> str:
 
 ## Actionable Recommendations
 
-{chr(10).join(f'{i+1}. {rec}' for i, rec in enumerate(advice.actionable_recommendations))}
+{_numbered(advice.actionable_recommendations)}
 
 ---
 
 ## Risk Mitigation Strategies
 
-{chr(10).join(f'- {strategy}' for strategy in advice.risk_mitigation_strategies)}
+{_bullets(advice.risk_mitigation_strategies)}
 
 ---
 
 ## Compliance Checklist
 
-{chr(10).join(f'- [ ] {item}' for item in advice.compliance_checklist)}
+{_bullets(advice.compliance_checklist, prefix="- [ ] ")}
 
 ---
 
 ## Next Steps
 
-{chr(10).join(f'{i+1}. {step}' for i, step in enumerate(advice.next_steps))}
+{_numbered(advice.next_steps)}
 
 ---
 
@@ -526,33 +964,38 @@ def generate_report(advice: SynthesizedAdvice, routing: QueryRouting) -> str:
 """
 
     for analysis in advice.specialist_analyses:
-        report += f"""
-### {analysis.category.value.replace('_', ' ').title()}
+        title = _CATEGORY_TITLES[analysis.category]
+        references = (
+            _bullets(analysis.regulatory_references)
+            if analysis.regulatory_references
+            else "- None provided"
+        )
+        yield f"""
+### {title}
 
 **Confidence Level:** {analysis.confidence_level}
 
 **Risk Assessment:** {analysis.risk_assessment}
 
 **Key Findings:**
-{chr(10).join(f'- {finding}' for finding in analysis.key_findings)}
+{_bullets(analysis.key_findings)}
 
 **Recommendations:**
-{chr(10).join(f'- {rec}' for rec in analysis.recommendations)}
+{_bullets(analysis.recommendations)}
 
 **Regulatory References:**
-{chr(10).join(f'- {ref}' for ref in analysis.regulatory_references) if analysis.regulatory_references else '- None provided'}
+{references}
 
 ---
 """
 
-    return report
-
 
 async def main(
     user_query: str,
     documents_dir: Path,
     output_report: Path,
     collection_names: dict[str, str] | None = None,
+    use_semantic_cache: bool = SEMANTIC_CACHE_ENABLED,
 ):
     """Main execution flow.
     
@@ -567,61 +1010,154 @@ async def main(
     collection_names : dict[str, str] | None
         Optional mapping of category names to Weaviate collection names.
         Example: {"cdd_red_flags": "my_cdd_collection", "sar_filing": "my_sar_collection"}
+    use_semantic_cache : bool
+        Reuse advice for semantically similar earlier queries, and store
+        this query's advice, in a local file. Off unless AML_SEMANTIC_CACHE=true.
     """
-    # Update knowledge base collections if custom ones provided
-    if collection_names:
-        for category_name, collection_name in collection_names.items():
-            try:
-                category = AMLCategory(category_name)
-                knowledge_bases[category] = AsyncWeaviateKnowledgeBase(
-                    async_weaviate_client,
-                    collection_name=collection_name,
-                    num_results=5,
-                    snippet_length=1000,
+    # Ctrl-C cancels this task so that cleanup below runs on the same loop
+    loop = asyncio.get_running_loop()
+    loop.add_signal_handler(signal.SIGINT, asyncio.current_task().cancel)  # type: ignore[union-attr]
+    try:
+        # Hold one Weaviate connection for the whole run; specialists search
+        # concurrently and reuse it instead of each connecting and closing.
+        # Without it, searches connect on demand and report failures as tool
+        # errors, so the run still completes.
+        try:
+            await async_weaviate_client.connect()
+        except Exception as e:
+            logger.warning(f"Could not connect to Weaviate: {e}")
+        await _advise(
+            user_query,
+            documents_dir,
+            output_report,
+            collection_names,
+            use_semantic_cache,
+        )
+    finally:
+        loop.remove_signal_handler(signal.SIGINT)
+        await _cleanup_clients()
+
+
+async def _run_agents(
+    user_query: str, documents: list[Document]
+) -> tuple[QueryRouting, SynthesizedAdvice, dict[str, Any]]:
+    """Route the query, consult specialists and synthesize advice.
+
+    Returns the routing, the advice, and the advice as JSON-ready output with
+    the already-dumped specialist analyses.
+    """
+    # Route query
+    print("Routing query to appropriate specialists...")
+    routing = await route_query(user_query)
+    print(f"Primary category: {_CATEGORY_LABELS[routing.primary_category]}")
+    if routing.secondary_categories:
+        print(
+            f"Secondary categories: {', '.join(_CATEGORY_LABELS[c] for c in routing.secondary_categories)}"
+        )
+    print(f"Reasoning: {routing.reasoning}\n")
+
+    # Get specialist analyses and synthesize advice as they arrive
+    print("Consulting specialists and synthesizing advice...")
+    advice, dumped_analyses = await synthesize_advice_streaming(
+        user_query,
+        routing,
+        stream_specialists(routing, user_query, documents),
+    )
+    print(
+        f"\nSynthesized {len(advice.specialist_analyses)} specialist analysis/analyses\n"
+    )
+
+    advice_output = {
+        **advice.model_dump(mode="json", exclude={"specialist_analyses"}),
+        "specialist_analyses": dumped_analyses,
+    }
+    return routing, advice, advice_output
+
+
+async def _advise(
+    user_query: str,
+    documents_dir: Path,
+    output_report: Path,
+    collection_names: dict[str, str] | None = None,
+    use_semantic_cache: bool = SEMANTIC_CACHE_ENABLED,
+):
+    """Run the advisory pipeline; see `main` for parameters."""
+    # Resolve custom knowledge base collections if provided
+    overrides: dict[AMLCategory, str] = {}
+    for category_name, collection_name in (collection_names or {}).items():
+        try:
+            overrides[AMLCategory(category_name)] = collection_name
+            print(f"Using collection '{collection_name}' for {category_name}")
+        except ValueError:
+            print(f"Warning: Unknown category '{category_name}', skipping")
+
+    # Build knowledge bases on first use; afterwards only replace the ones whose
+    # collection actually changed, so existing instances are reused.
+    if not knowledge_bases:
+        knowledge_bases.update(build_knowledge_bases(async_weaviate_client, overrides))
+    else:
+        for category, collection_name in overrides.items():
+            if knowledge_bases[category].collection_name != collection_name:
+                knowledge_bases[category] = _make_kb(
+                    async_weaviate_client, collection_name
                 )
-                print(f"Using collection '{collection_name}' for {category_name}")
-            except ValueError:
-                print(f"Warning: Unknown category '{category_name}', skipping")
-    
+
     print(f"\n{'='*80}")
     print("AML ADVISORY MULTI-AGENT SYSTEM")
     print(f"{'='*80}\n")
 
     # Load documents
     print(f"Loading documents from: {documents_dir}")
-    documents = load_documents(documents_dir)
+    documents = await load_documents(documents_dir)
     print(f"Loaded {len(documents)} document(s)\n")
 
     if not documents:
         print("Warning: No documents loaded. Proceeding with query-only analysis.\n")
 
-    # Route query
-    print("Routing query to appropriate specialists...")
-    with langfuse_client.start_as_current_span(name="AML Advisory Session") as session:
-        routing = await route_query(user_query)
-        print(f"Primary category: {routing.primary_category.value}")
-        if routing.secondary_categories:
-            print(
-                f"Secondary categories: {', '.join(c.value for c in routing.secondary_categories)}"
-            )
-        print(f"Reasoning: {routing.reasoning}\n")
-
-        # Get specialist analyses
-        analyses = await process_specialists(routing, user_query, documents)
-        print(f"\nReceived {len(analyses)} specialist analysis/analyses\n")
-
-        # Synthesize advice
-        print("Synthesizing final advice...")
-        advice = await synthesize_advice(user_query, routing, analyses)
-
-        session.update(
-            input={"query": user_query, "num_documents": len(documents)},
-            output=advice.model_dump(),
-        )
+    trace_consumer = asyncio.create_task(_drain_trace_queue())
+    try:
+        with langfuse_client.start_as_current_span(
+            name="AML Advisory Session"
+        ) as session:
+            cached, cache_namespace = None, ""
+            if use_semantic_cache:
+                # Reuse advice for semantically similar queries over the same setup
+                cache_namespace = _semantic_cache_namespace(documents)
+                cached = await _lookup_cached_advice(user_query, cache_namespace)
+            if cached is not None:
+                print("Found cached advice for a similar query, skipping agents.\n")
+                routing = QueryRouting.model_validate_json(cached["routing"])
+                advice = SynthesizedAdvice.model_validate_json(cached["advice"])
+                session.update(
+                    input={"query": user_query, "num_documents": len(documents)},
+                    output=advice.model_dump(mode="json"),
+                    metadata={"semantic_cache_hit": True},
+                )
+            else:
+                routing, advice, advice_output = await _run_agents(
+                    user_query, documents
+                )
+                session.update(
+                    input={"query": user_query, "num_documents": len(documents)},
+                    output=advice_output,
+                    metadata={"semantic_cache_hit": False},
+                )
+                if use_semantic_cache:
+                    await _store_cached_advice(
+                        user_query,
+                        {
+                            "routing": routing.model_dump_json(),
+                            "advice": msgspec.json.encode(advice_output).decode(),
+                        },
+                        cache_namespace,
+                    )
+    finally:
+        # Spans are ended by the trace consumer, so finish them even when the
+        # run fails or is interrupted; failed runs need their traces most
+        await _finish_traces(trace_consumer)
 
     # Generate report
-    report = generate_report(advice, routing)
-    output_report.write_text(report, encoding="utf-8")
+    write_report(advice, routing, output_report)
 
     print(f"\n{'='*80}")
     print(f"Report generated: {output_report}")
@@ -678,6 +1214,14 @@ if __name__ == "__main__":
         help="Specify custom Weaviate collection for a category. Format: category=collection_name. "
         "Can be used multiple times. Categories: cdd_red_flags, regulatory_updates, sar_filing, policy_review, scenario_testing",
     )
+    parser.add_argument(
+        "--semantic_cache",
+        action="store_true",
+        default=SEMANTIC_CACHE_ENABLED,
+        help=f"Reuse advice for similar earlier queries; queries and advice are "
+        f"stored in plain text in {SEMANTIC_CACHE_PATH} for up to a day. "
+        "Also enabled by AML_SEMANTIC_CACHE=true.",
+    )
 
     args = parser.parse_args()
 
@@ -695,12 +1239,14 @@ if __name__ == "__main__":
     set_up_logging()
     setup_langfuse_tracer()
 
-    # Register signal handler for graceful shutdown
-    import signal
-    signal.signal(signal.SIGINT, _handle_sigint)
-
-    try:
-        asyncio.run(main(args.query, args.documents_dir, args.output_report, collection_names))
-    finally:
-        # Cleanup on exit
-        asyncio.run(_cleanup_clients())
+    # `main` handles SIGINT and closes clients itself before returning
+    with contextlib.suppress(asyncio.CancelledError):
+        asyncio.run(
+            main(
+                args.query,
+                args.documents_dir,
+                args.output_report,
+                collection_names,
+                args.semantic_cache,
+            )
+        )
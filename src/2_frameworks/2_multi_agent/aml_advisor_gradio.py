@@ -15,19 +15,28 @@ Features:
 """
 
 import asyncio
+import atexit
 import contextlib
+import dataclasses
+import functools
+import logging
 import signal
 import sys
+import time
 from enum import Enum
+from types import MappingProxyType
+from typing import Any, AsyncIterator, Mapping
 
 import agents
 import gradio as gr
+import httpx
 import openai
 import pydantic
 from dotenv import load_dotenv
 from gradio.components.chatbot import ChatMessage
 
 from src.utils import (
+    AsyncTTLCache,
     AsyncWeaviateKnowledgeBase,
     Configs,
     get_weaviate_async_client,
@@ -41,6 +50,13 @@ from src.utils.langfuse.shared_client import langfuse_client
 # Load environment variables
 load_dotenv(verbose=True)
 set_up_logging()
+setup_langfuse_tracer()
+# `langfuse_client` exports events in batches; send what is buffered on exit.
+atexit.register(langfuse_client.flush)
+
+logger = logging.getLogger(__name__)
+
+SESSION_TRACE_NAME = "AML-Advisory-Session"
 
 
 class AMLCategory(str, Enum):
@@ -60,7 +76,14 @@ AGENT_LLM_NAMES = {
     "main": "gemini-2.5-pro",
 }
 
-MAX_CONCURRENCY = {"specialist": 3}
+# "session": chat requests Gradio runs at once; excess requests wait in a
+# queue of at most QUEUE_MAX_SIZE. All sessions share the gates below.
+MAX_CONCURRENCY = {"session": 8, "specialist": 3, "search": 3}
+QUEUE_MAX_SIZE = 64
+
+# Streaming UI updates: flush after this many seconds or pending messages
+STREAM_FLUSH_INTERVAL = 0.05
+STREAM_FLUSH_MAX_PENDING = 8
 MAX_GENERATED_TOKENS = {"router": 8192, "specialist": 32768, "main": 32768}
 
 # Knowledge base collection names for different AML domains
@@ -91,6 +114,10 @@ class SpecialistAnalysis(pydantic.BaseModel):
     regulatory_references: list[str] = pydantic.Field(default_factory=list)
 
 
+# Built once so the SDK does not rebuild the TypeAdapter and JSON schema per run
+ROUTING_SCHEMA = agents.AgentOutputSchema(QueryRouting)
+
+
 # Initialize clients
 configs = Configs.from_env_var()
 async_weaviate_client = get_weaviate_async_client(
@@ -102,74 +129,213 @@ async_weaviate_client = get_weaviate_async_client(
     grpc_secure=configs.weaviate_grpc_secure,
     api_key=configs.weaviate_api_key,
 )
-async_openai_client = openai.AsyncOpenAI()
+# HTTP/2 with a larger pool so concurrent specialist LLM calls share
+# connections instead of queueing at the transport layer. The OpenAI client
+# adopts this timeout, so keep the SDK's 600 s default for long high-effort
+# reasoning turns and only fail fast on connect.
+_http_client = httpx.AsyncClient(
+    http2=True,
+    limits=httpx.Limits(max_connections=100, max_keepalive_connections=50),
+    timeout=httpx.Timeout(600.0, connect=5.0),
+)
+async_openai_client = openai.AsyncOpenAI(http_client=_http_client)
 
-# Initialize knowledge bases for each AML category
-knowledge_bases: dict[AMLCategory, AsyncWeaviateKnowledgeBase] = {}
-for category, collection_name in KNOWLEDGE_BASE_COLLECTIONS.items():
+
+def _make_kb(collection_name: str) -> AsyncWeaviateKnowledgeBase:
+    """Build a knowledge base over one collection with the app's search settings."""
+    return AsyncWeaviateKnowledgeBase(
+        async_weaviate_client,
+        collection_name=collection_name,
+        num_results=5,
+        snippet_length=1000,
+    )
+
+
+# Shared by every category whose own collection is missing
+_fallback_kb = _make_kb("enwiki_20250520")
+
+
+async def _init_kb(
+    category: AMLCategory, collection_name: str
+) -> tuple[AMLCategory, AsyncWeaviateKnowledgeBase]:
+    """Build the knowledge base for a category, falling back if it is missing."""
     try:
-        knowledge_bases[category] = AsyncWeaviateKnowledgeBase(
-            async_weaviate_client,
-            collection_name=collection_name,
-            num_results=5,
-            snippet_length=1000,
-        )
+        exists = await async_weaviate_client.collections.exists(collection_name)
     except Exception as e:
-        print(f"Warning: Could not initialize knowledge base for {category.value}: {e}")
-        # Use fallback collection
-        knowledge_bases[category] = AsyncWeaviateKnowledgeBase(
-            async_weaviate_client,
-            collection_name="enwiki_20250520",
-            num_results=5,
-            snippet_length=1000,
+        # A failed probe says nothing about the collection; keep it, and let
+        # searches surface the error instead of pinning the fallback
+        logger.warning(f"Could not check collection '{collection_name}': {e}")
+        exists = True
+    if not exists:
+        logger.warning(
+            f"Collection '{collection_name}' not found; "
+            f"{category.value} uses the fallback knowledge base"
         )
+        return category, _fallback_kb
+    return category, _make_kb(collection_name)
+
+
+async def _bootstrap() -> dict[AMLCategory, AsyncWeaviateKnowledgeBase]:
+    """Probe all knowledge base collections concurrently over one connection.
+
+    If Weaviate is unreachable, every category keeps its own collection and
+    searches report the error, so the app still starts.
+    """
+    try:
+        async with async_weaviate_client:
+            pairs = await asyncio.gather(
+                *[
+                    _init_kb(category, collection_name)
+                    for category, collection_name in KNOWLEDGE_BASE_COLLECTIONS.items()
+                ]
+            )
+    except Exception as e:
+        logger.warning(f"Could not probe knowledge base collections: {e}")
+        return {
+            category: _make_kb(collection_name)
+            for category, collection_name in KNOWLEDGE_BASE_COLLECTIONS.items()
+        }
+    return dict(pairs)
+
+
+# Initialize knowledge bases for each AML category
+knowledge_bases: dict[AMLCategory, AsyncWeaviateKnowledgeBase] = asyncio.run(
+    _bootstrap()
+)
+# Same mapping keyed by category value, so that routed category strings can
+# be looked up without an `AMLCategory(...)` coercion
+_KB_BY_STR: dict[str, AsyncWeaviateKnowledgeBase] = {
+    category.value: kb for category, kb in knowledge_bases.items()
+}
+
+
+# Bound concurrent specialist consultations and knowledge base searches across
+# all sessions. Separate semaphores, since searches run inside consultations.
+_specialist_sem = asyncio.Semaphore(MAX_CONCURRENCY["specialist"])
+_search_sem = asyncio.Semaphore(MAX_CONCURRENCY["search"])
+
+# Serializes the first connect so concurrent first sessions share one connection
+_weaviate_connect_lock = asyncio.Lock()
+
+# Recent KB search results keyed by (collection, query). Identical searches
+# in flight at the same time, e.g. from parallel specialists, share one call.
+_search_cache = AsyncTTLCache(ttl=60, max_size=512)
+
+
+def _gated_tool(tool: agents.FunctionTool) -> agents.FunctionTool:
+    """Return a copy of `tool` whose invocations hold `_specialist_sem`."""
+    invoke = tool.on_invoke_tool
+
+    async def gated_invoke(ctx: Any, input_json: str) -> Any:
+        async with _specialist_sem:
+            return await invoke(ctx, input_json)
+
+    return dataclasses.replace(tool, on_invoke_tool=gated_invoke)
+
+
+_clients_closed = False
+
+# Loop that serves chat requests, in Gradio's worker thread; the clients'
+# connections belong to it, so they must be closed there
+_serving_loop: asyncio.AbstractEventLoop | None = None
 
 
 async def _cleanup_clients() -> None:
-    """Close async clients."""
-    await async_weaviate_client.close()
-    await async_openai_client.close()
+    """Close async clients. Safe to call more than once.
+
+    Each client is closed independently so one failure does not leak the rest.
+    """
+    global _clients_closed  # noqa: PLW0603
+    if _clients_closed:
+        return
+
+    with contextlib.suppress(Exception):
+        await async_weaviate_client.close()
+    with contextlib.suppress(Exception):
+        await async_openai_client.close()
+    with contextlib.suppress(Exception):
+        await _http_client.aclose()
+    _clients_closed = True
+
+
+def _shutdown_clients(timeout: float = 10.0) -> None:
+    """Close async clients from a synchronous context, on the serving loop.
+
+    Falls back to a fresh loop if no request has been served yet, or if the
+    serving loop has already stopped.
+    """
+    loop = _serving_loop
+    with contextlib.suppress(Exception):
+        if loop is not None and loop.is_running():
+            asyncio.run_coroutine_threadsafe(_cleanup_clients(), loop).result(
+                timeout=timeout
+            )
+        else:
+            asyncio.run(_cleanup_clients())
 
 
 def _handle_sigint(signum: int, frame: object) -> None:
     """Handle SIGINT signal to gracefully shutdown."""
-    with contextlib.suppress(Exception):
-        asyncio.get_event_loop().run_until_complete(_cleanup_clients())
+    # Runs in the main thread while Gradio serves from a worker thread
+    _shutdown_clients()
     sys.exit(0)
 
 
-# Create specialist agents for each AML category
-def create_specialist_agent(
-    category: AMLCategory, knowledge_base: AsyncWeaviateKnowledgeBase
-) -> agents.Agent:
-    """Create a specialist agent for a specific AML category with knowledge base access."""
-
-    instructions_map = {
-        AMLCategory.CDD_RED_FLAGS: """You are an expert in Customer Due Diligence (CDD) and KYC.
+# Specialist instructions per category, built once at import
+_SPECIALIST_INSTRUCTIONS: Mapping[AMLCategory, str] = MappingProxyType({
+    AMLCategory.CDD_RED_FLAGS: """You are an expert in Customer Due Diligence (CDD) and KYC.
         Use the search tool to find relevant information about red flags, risk indicators, 
         and compliance requirements. Provide specific, actionable insights based on current AML standards.""",
-        AMLCategory.REGULATORY_UPDATES: """You are an expert in AML regulatory compliance.
+    AMLCategory.REGULATORY_UPDATES: """You are an expert in AML regulatory compliance.
         Use the search tool to find information about regulatory changes, compliance requirements,
         and jurisdictional considerations. Reference specific regulations when possible.""",
-        AMLCategory.SAR_FILING: """You are an expert in Suspicious Activity Report (SAR) filing.
+    AMLCategory.SAR_FILING: """You are an expert in Suspicious Activity Report (SAR) filing.
         Use the search tool to find SAR guidelines, filing procedures, and best practices.
         Help draft SARs that meet regulatory standards.""",
-        AMLCategory.POLICY_REVIEW: """You are an expert in AML policy development and review.
+    AMLCategory.POLICY_REVIEW: """You are an expert in AML policy development and review.
         Use the search tool to find policy templates, industry standards, and best practices.
         Identify gaps and recommend improvements.""",
-        AMLCategory.SCENARIO_TESTING: """You are an expert in AML scenario analysis and testing.
+    AMLCategory.SCENARIO_TESTING: """You are an expert in AML scenario analysis and testing.
         Use the search tool to find case studies and guidance. Provide step-by-step
         recommendations for handling scenarios.""",
-    }
+})
+
+
+# Search tool (name, description) per category, built once at import
+_TOOL_META: dict[AMLCategory, tuple[str, str]] = {
+    c: (
+        f"search_{c.value}",
+        f"Search the {c.value.replace('_', ' ')} knowledge base for AML information.",
+    )
+    for c in AMLCategory
+}
+
+
+# Create specialist agents for each AML category
+def create_specialist_agent(
+    category: AMLCategory, knowledge_base: AsyncWeaviateKnowledgeBase
+) -> agents.Agent:
+    """Create a specialist agent for a specific AML category with knowledge base access."""
+
+    @functools.wraps(knowledge_base.search_knowledgebase)
+    async def gated_search(*args: Any, **kwargs: Any) -> Any:
+        async with _search_sem:
+            return await knowledge_base.search_knowledgebase(*args, **kwargs)
+
+    collection_name = knowledge_base.collection_name
+    cached_search = _search_cache.wrap(
+        gated_search, key_fn=lambda keyword: (collection_name, keyword)
+    )
 
+    tool_name, tool_description = _TOOL_META[category]
     return agents.Agent(
         f"AML_{category.value}_specialist",
-        instructions=instructions_map[category],
+        instructions=_SPECIALIST_INSTRUCTIONS[category],
         tools=[
             agents.function_tool(
-                knowledge_base.search_knowledgebase,
-                tool_name=f"search_{category.value}",
-                tool_description=f"Search the {category.value.replace('_', ' ')} knowledge base for AML information.",
+                cached_search,
+                tool_name=tool_name,
+                tool_description=tool_description,
             )
         ],
         model=agents.OpenAIChatCompletionsModel(
@@ -184,15 +350,34 @@ def create_specialist_agent(
     )
 
 
-# Initialize specialist agents
-specialist_agents = {}
-for category, kb in knowledge_bases.items():
-    specialist_agents[category] = create_specialist_agent(category, kb)
+# Cheap first pass that picks the specialists to consult, so that only those
+# run at high reasoning effort
+router_agent = agents.Agent(
+    "AML Query Router",
+    instructions="""You are an expert AML advisor router. Analyze the user's query and determine:
+    1. The primary AML category it falls under
+    2. Any secondary categories that should be consulted
+
+    Categories:
+    - cdd_red_flags: Customer Due Diligence red flags and risk indicators
+    - regulatory_updates: Changes in AML regulations and compliance requirements
+    - sar_filing: Suspicious Activity Report drafting and filing
+    - policy_review: AML policy analysis and gap identification
+    - scenario_testing: Hypothetical scenario analysis and guidance
+
+    Only list secondary categories that are clearly needed to answer the query.""",
+    output_type=ROUTING_SCHEMA,
+    model=agents.OpenAIChatCompletionsModel(
+        model=AGENT_LLM_NAMES["router"], openai_client=async_openai_client
+    ),
+    model_settings=agents.ModelSettings(
+        reasoning=openai.types.Reasoning(effort="low"),
+        max_tokens=MAX_GENERATED_TOKENS["router"],
+    ),
+)
+
 
-# Main AML Advisory Agent
-main_agent = agents.Agent(
-    name="AML_Advisor",
-    instructions="""You are a senior AML (Anti-Money Laundering) compliance advisor.
+MAIN_AGENT_INSTRUCTIONS = """You are a senior AML (Anti-Money Laundering) compliance advisor.
 
 Your role is to provide expert guidance on:
 1. Customer Due Diligence (CDD) - red flags and risk assessment
@@ -209,52 +394,206 @@ When a user asks a question:
 5. Reference relevant regulations and best practices
 
 Be thorough, professional, and ensure all advice is compliant with AML regulations.
-Always cite your sources when referencing specific regulations or guidelines.""",
-    tools=[
-        specialist_agents[AMLCategory.CDD_RED_FLAGS].as_tool(
-            tool_name="consult_cdd_specialist",
-            tool_description="Consult the Customer Due Diligence specialist for red flags, risk assessment, and KYC guidance.",
-        ),
-        specialist_agents[AMLCategory.REGULATORY_UPDATES].as_tool(
-            tool_name="consult_regulatory_specialist",
-            tool_description="Consult the Regulatory Updates specialist for compliance changes and regulatory requirements.",
-        ),
-        specialist_agents[AMLCategory.SAR_FILING].as_tool(
-            tool_name="consult_sar_specialist",
-            tool_description="Consult the SAR Filing specialist for suspicious activity reporting guidance.",
-        ),
-        specialist_agents[AMLCategory.POLICY_REVIEW].as_tool(
-            tool_name="consult_policy_specialist",
-            tool_description="Consult the Policy Review specialist for AML policy analysis and improvements.",
-        ),
-        specialist_agents[AMLCategory.SCENARIO_TESTING].as_tool(
-            tool_name="consult_scenario_specialist",
-            tool_description="Consult the Scenario Testing specialist for handling hypothetical AML situations.",
-        ),
-    ],
-    model=agents.OpenAIChatCompletionsModel(
-        model=AGENT_LLM_NAMES["main"], openai_client=async_openai_client
+Always cite your sources when referencing specific regulations or guidelines."""
+
+
+# Main-agent tool (name, description) per specialist
+_CONSULT_TOOL_META: dict[AMLCategory, tuple[str, str]] = {
+    AMLCategory.CDD_RED_FLAGS: (
+        "consult_cdd_specialist",
+        "Consult the Customer Due Diligence specialist for red flags, risk assessment, and KYC guidance.",
     ),
-    model_settings=agents.ModelSettings(
-        reasoning=openai.types.Reasoning(effort="high", generate_summary="detailed"),
-        max_tokens=MAX_GENERATED_TOKENS["main"],
+    AMLCategory.REGULATORY_UPDATES: (
+        "consult_regulatory_specialist",
+        "Consult the Regulatory Updates specialist for compliance changes and regulatory requirements.",
     ),
-)
+    AMLCategory.SAR_FILING: (
+        "consult_sar_specialist",
+        "Consult the SAR Filing specialist for suspicious activity reporting guidance.",
+    ),
+    AMLCategory.POLICY_REVIEW: (
+        "consult_policy_specialist",
+        "Consult the Policy Review specialist for AML policy analysis and improvements.",
+    ),
+    AMLCategory.SCENARIO_TESTING: (
+        "consult_scenario_specialist",
+        "Consult the Scenario Testing specialist for handling hypothetical AML situations.",
+    ),
+}
+
+
+# Specialist agents keyed by category value, filled in by `get_specialist`
+_AGENT_BY_STR: dict[str, agents.Agent] = {}
+
+
+def get_specialist(category: str) -> agents.Agent:
+    """Return the specialist agent for a category value, building it on first use.
+
+    Takes the raw value (e.g. "sar_filing") rather than an `AMLCategory`, so
+    routing output can be dispatched with plain string lookups.
+    """
+    agent = _AGENT_BY_STR.get(category)
+    if agent is None:
+        agent = create_specialist_agent(AMLCategory(category), _KB_BY_STR[category])
+        _AGENT_BY_STR[category] = agent
+    return agent
+
+
+ALL_CATEGORIES = tuple(category.value for category in AMLCategory)
+
+
+@functools.lru_cache(maxsize=None)
+def get_main_agent(categories: tuple[str, ...] = ALL_CATEGORIES) -> agents.Agent:
+    """Return the main AML advisory agent, building it on first use.
+
+    Parameters
+    ----------
+    categories : tuple[str, ...], optional, default=ALL_CATEGORIES
+        Category values whose specialists are offered as tools. Pass them in
+        a canonical order so that equal selections share one agent.
+    """
+    return agents.Agent(
+        name="AML_Advisor",
+        instructions=MAIN_AGENT_INSTRUCTIONS,
+        tools=[
+            _gated_tool(
+                get_specialist(category.value).as_tool(
+                    tool_name=tool_name, tool_description=tool_description
+                )
+            )
+            for category, (tool_name, tool_description) in _CONSULT_TOOL_META.items()
+            if category.value in categories
+        ],
+        model=agents.OpenAIChatCompletionsModel(
+            model=AGENT_LLM_NAMES["main"], openai_client=async_openai_client
+        ),
+        model_settings=agents.ModelSettings(
+            reasoning=openai.types.Reasoning(effort="high", generate_summary="detailed"),
+            max_tokens=MAX_GENERATED_TOKENS["main"],
+        ),
+    )
+
+
+async def route_query(question: str) -> QueryRouting | None:
+    """Route the question to specialist categories, or None if routing fails."""
+    try:
+        result = await agents.Runner.run(router_agent, input=question)
+        return result.final_output_as(QueryRouting)
+    except (agents.AgentsException, openai.APIError) as e:
+        logger.warning(f"Routing error, consulting all specialists: {e}")
+        return None
+
+
+def routed_categories(routing: QueryRouting | None) -> tuple[str, ...]:
+    """Return the routed category values in canonical order, or all if unrouted."""
+    if routing is None:
+        return ALL_CATEGORIES
+
+    selected = {routing.primary_category.value}
+    selected.update(category.value for category in routing.secondary_categories)
+    return tuple(category for category in ALL_CATEGORIES if category in selected)
+
+
+async def _with_idle_ticks(
+    events: AsyncIterator[Any], interval: float
+) -> AsyncIterator[Any | None]:
+    """Yield items from `events`, and None whenever `interval` passes without one.
+
+    The pending `__anext__` is awaited across ticks rather than cancelled, so
+    the underlying stream is never interrupted.
+    """
+    iterator = aiter(events)
+    next_item = asyncio.ensure_future(anext(iterator))
+    try:
+        while True:
+            done, _ = await asyncio.wait({next_item}, timeout=interval)
+            if not done:
+                yield None
+                continue
+            try:
+                item = next_item.result()
+            except StopAsyncIteration:
+                return
+            next_item = asyncio.ensure_future(anext(iterator))
+            yield item
+    finally:
+        next_item.cancel()
+
+
+async def _ensure_weaviate_connected() -> None:
+    """Open the shared Weaviate connection on the serving loop, once.
+
+    On failure, searches connect on demand and report errors as tool output.
+    """
+    async with _weaviate_connect_lock:
+        if async_weaviate_client.is_connected():
+            return
+        try:
+            await async_weaviate_client.connect()
+        except Exception as e:
+            logger.warning(f"Could not connect to Weaviate: {e}")
 
 
 async def _main(question: str, gr_messages: list[ChatMessage]):
     """Main async function to handle user queries with streaming responses."""
-    setup_langfuse_tracer()
+    global _serving_loop  # noqa: PLW0603
+    _serving_loop = asyncio.get_running_loop()
 
-    with langfuse_client.start_as_current_span(name="AML-Advisory-Session") as span:
+    with langfuse_client.start_as_current_span(name=SESSION_TRACE_NAME) as span:
         span.update(input=question)
 
-        # Stream the agent's response
-        result_stream = agents.Runner.run_streamed(main_agent, input=question)
-        async for _item in result_stream.stream_events():
-            gr_messages += oai_agent_stream_to_gradio_messages(_item)
-            if len(gr_messages) > 0:
-                yield gr_messages
+        # Keep one Weaviate connection open on the serving loop for all
+        # sessions' searches; `_cleanup_clients` closes it on shutdown
+        await _ensure_weaviate_connected()
+
+        routing = await route_query(question)
+        categories = routed_categories(routing)
+        if len(categories) == 1:
+            # Confidently single-domain: the specialist answers directly, and
+            # counts against the same limit as specialists used as tools
+            agent = get_specialist(categories[0])
+            gate: contextlib.AbstractAsyncContextManager[Any] = _specialist_sem
+        else:
+            # Main agent that can consult only the routed specialists
+            agent = get_main_agent(categories)
+            gate = contextlib.nullcontext()
+
+        if routing is not None:
+            gr_messages.append(
+                ChatMessage(
+                    role="assistant",
+                    content=routing.reasoning,
+                    metadata={"title": f"Routed to `{agent.name}`"},
+                )
+            )
+            yield gr_messages
+
+        async with gate:
+            # Stream the agent's response, coalescing events so that the growing
+            # transcript is re-sent to the UI at most every STREAM_FLUSH_INTERVAL.
+            # Idle ticks flush pending messages while the stream is quiet.
+            result_stream = agents.Runner.run_streamed(agent, input=question)
+            last_flush = time.monotonic()
+            pending = 0
+            async for _item in _with_idle_ticks(
+                result_stream.stream_events(), STREAM_FLUSH_INTERVAL
+            ):
+                if _item is not None:
+                    new_messages = oai_agent_stream_to_gradio_messages(_item)
+                    gr_messages.extend(new_messages)
+                    pending += len(new_messages)
+
+                now = time.monotonic()
+                if pending > 0 and (
+                    now - last_flush >= STREAM_FLUSH_INTERVAL
+                    or pending >= STREAM_FLUSH_MAX_PENDING
+                ):
+                    yield gr_messages
+                    last_flush = now
+                    pending = 0
+
+        if len(gr_messages) > 0:
+            yield gr_messages
 
         span.update(output=result_stream.final_output)
 
@@ -295,6 +634,10 @@ demo = gr.ChatInterface(
     }
     """,
 )
+# Stream several users' turns in parallel instead of one at a time
+demo.queue(
+    default_concurrency_limit=MAX_CONCURRENCY["session"], max_size=QUEUE_MAX_SIZE
+)
 
 if __name__ == "__main__":
     signal.signal(signal.SIGINT, _handle_sigint)
@@ -313,5 +656,5 @@ if __name__ == "__main__":
         demo.launch(share=True)
     finally:
         print("\nShutting down...")
-        asyncio.run(_cleanup_clients())
+        _shutdown_clients()
         print("Cleanup complete.")
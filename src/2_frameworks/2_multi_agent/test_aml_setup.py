@@ -8,10 +8,12 @@ Usage:
 """
 
 import asyncio
+import contextlib
 import sys
 from pathlib import Path
 
 from dotenv import load_dotenv
+from weaviate import WeaviateAsyncClient
 
 # Add src to path
 sys.path.insert(0, str(Path(__file__).parent.parent.parent.parent))
@@ -23,6 +25,38 @@ from src.utils import (
 )
 
 
+async def probe_collections(
+    client: WeaviateAsyncClient, collection_names: list[str]
+) -> tuple[list[str], list[str]]:
+    """Try a simple search against each collection concurrently and report it.
+
+    Returns
+    -------
+    tuple[list[str], list[str]]
+        Names of the available collections, and of those that need a fallback.
+    """
+
+    async def probe(name: str) -> tuple[str, list | None, Exception | None]:
+        """Try a simple search against one collection."""
+        kb = AsyncWeaviateKnowledgeBase(client, collection_name=name, num_results=1)
+        try:
+            return name, await kb.search_knowledgebase("test"), None
+        except Exception as e:
+            return name, None, e
+
+    available, missing = [], []
+    for name, results, error in await asyncio.gather(
+        *(probe(name) for name in collection_names)
+    ):
+        if error is None:
+            print(f"   ✓ {name}: Available ({len(results)} test results)")
+            available.append(name)
+        else:
+            print(f"   ⚠ {name}: Not found (will use fallback)")
+            missing.append(name)
+    return available, missing
+
+
 async def test_setup():
     """Test all components of the AML advisor setup."""
     print("\n" + "=" * 80)
@@ -46,80 +80,66 @@ async def test_setup():
         return False
     print()
 
-    # Test Weaviate connection
+    # Test Weaviate connection. The stack keeps one connection open for steps
+    # 3-5 while a failed connect is still reported by this step.
     print("3. Testing Weaviate connection...")
-    try:
-        async_weaviate_client = get_weaviate_async_client(
-            http_host=configs.weaviate_http_host,
-            http_port=configs.weaviate_http_port,
-            http_secure=configs.weaviate_http_secure,
-            grpc_host=configs.weaviate_grpc_host,
-            grpc_port=configs.weaviate_grpc_port,
-            grpc_secure=configs.weaviate_grpc_secure,
-            api_key=configs.weaviate_api_key,
-        )
-
-        async with async_weaviate_client:
+    async with contextlib.AsyncExitStack() as stack:
+        try:
+            async_weaviate_client = get_weaviate_async_client(
+                http_host=configs.weaviate_http_host,
+                http_port=configs.weaviate_http_port,
+                http_secure=configs.weaviate_http_secure,
+                grpc_host=configs.weaviate_grpc_host,
+                grpc_port=configs.weaviate_grpc_port,
+                grpc_secure=configs.weaviate_grpc_secure,
+                api_key=configs.weaviate_api_key,
+            )
+            await stack.enter_async_context(async_weaviate_client)
             is_ready = await async_weaviate_client.is_ready()
             if is_ready:
                 print("   ✓ Weaviate connection successful")
             else:
                 print("   ✗ Weaviate not ready")
                 return False
-    except Exception as e:
-        print(f"   ✗ Weaviate connection failed: {e}")
-        return False
-    print()
-
-    # Test knowledge base collections
-    print("4. Testing knowledge base collections...")
-    collections_to_test = [
-        "aml_cdd_redflags",
-        "aml_regulations",
-        "aml_sar_guidelines",
-        "aml_policies",
-        "aml_case_studies",
-    ]
-
-    available_collections = []
-    fallback_collections = []
-
-    for collection_name in collections_to_test:
-        try:
-            kb = AsyncWeaviateKnowledgeBase(
-                async_weaviate_client,
-                collection_name=collection_name,
-                num_results=1,
-            )
-            # Try a simple search to verify it works
-            async with async_weaviate_client:
-                results = await kb.search_knowledgebase("test")
-                print(f"   ✓ {collection_name}: Available ({len(results)} test results)")
-                available_collections.append(collection_name)
         except Exception as e:
-            print(f"   ⚠ {collection_name}: Not found (will use fallback)")
-            fallback_collections.append(collection_name)
-    print()
-
-    # Test fallback collection
-    if fallback_collections:
-        print("5. Testing fallback collection (enwiki_20250520)...")
-        try:
-            kb = AsyncWeaviateKnowledgeBase(
-                async_weaviate_client,
-                collection_name="enwiki_20250520",
-                num_results=1,
-            )
-            async with async_weaviate_client:
+            print(f"   ✗ Weaviate connection failed: {e}")
+            return False
+        print()
+
+        # Test knowledge base collections
+        print("4. Testing knowledge base collections...")
+        collections_to_test = [
+            "aml_cdd_redflags",
+            "aml_regulations",
+            "aml_sar_guidelines",
+            "aml_policies",
+            "aml_case_studies",
+        ]
+
+        # Probes are independent, so run them concurrently
+        available_collections, fallback_collections = await probe_collections(
+            async_weaviate_client, collections_to_test
+        )
+        print()
+
+        # Test fallback collection
+        if fallback_collections:
+            print("5. Testing fallback collection (enwiki_20250520)...")
+            try:
+                kb = AsyncWeaviateKnowledgeBase(
+                    async_weaviate_client,
+                    collection_name="enwiki_20250520",
+                    num_results=1,
+                )
                 results = await kb.search_knowledgebase("test")
                 print(f"   ✓ Fallback collection available ({len(results)} test results)")
                 print(
                     f"   ℹ {len(fallback_collections)} collection(s) will use fallback"
                 )
-        except Exception as e:
-            print(f"   ✗ Fallback collection also unavailable: {e}")
-            print("   ⚠ You may need to create AML-specific collections")
-    print()
+            except Exception as e:
+                print(f"   ✗ Fallback collection also unavailable: {e}")
+                print("   ⚠ You may need to create AML-specific collections")
+        print()
 
     # Summary
     print("=" * 80)
@@ -148,9 +168,6 @@ async def test_setup():
     )
     print()
 
-    # Cleanup
-    await async_weaviate_client.close()
-
     return True
 
 
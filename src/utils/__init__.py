@@ -11,6 +11,8 @@ from .gradio.messages import (
 from .langfuse.oai_sdk_setup import setup_langfuse_tracer
 from .logging import set_up_logging
 from .pretty_printing import pretty_print
+from .query_cache import AsyncTTLCache
+from .semantic_cache import SemanticCache
 from .tools.code_interpreter import CodeInterpreter
 from .tools.kb_weaviate import AsyncWeaviateKnowledgeBase, get_weaviate_async_client
 from .trees import tree_filter
@@ -14,6 +14,10 @@ from opentelemetry.sdk.trace.export import SimpleSpanProcessor
 from .otlp_env_setup import set_up_langfuse_otlp_env_vars
 
 
+# Tracer from the first `setup_langfuse_tracer` call; empty until then
+_registered_tracer: list["trace.Tracer"] = []
+
+
 def configure_oai_agents_sdk(service_name: str) -> None:
     """Register Langfuse as tracing provider for OAI Agents SDK."""
     nest_asyncio.apply()
@@ -24,10 +28,21 @@ def configure_oai_agents_sdk(service_name: str) -> None:
 def setup_langfuse_tracer(service_name: str = "agents_sdk") -> "trace.Tracer":
     """Register Langfuse as the default tracing provider and return tracer.
 
+    Idempotent: later calls return the tracer from the first registration,
+    ignoring their arguments, instead of re-registering providers.
+
+    Parameters
+    ----------
+    service_name : str, optional, default="agents_sdk"
+        Service name reported with the traces.
+
     Returns
     -------
     tracer: OpenTelemetry Tracer
     """
+    if _registered_tracer:
+        return _registered_tracer[0]
+
     set_up_langfuse_otlp_env_vars()
     configure_oai_agents_sdk(service_name)
 
@@ -39,4 +54,5 @@ def setup_langfuse_tracer(service_name: str = "agents_sdk") -> "trace.Tracer":
 
     # Set the global default tracer provider
     trace.set_tracer_provider(trace_provider)
-    return trace.get_tracer(__name__)
+    _registered_tracer.append(trace.get_tracer(__name__))
+    return _registered_tracer[0]
@@ -13,8 +13,16 @@ __all__ = ["langfuse_client"]
 
 config = Configs.from_env_var()
 assert getenv("LANGFUSE_PUBLIC_KEY") is not None
+# Buffer events and export them in batches so that span updates never block
+# the caller; `flush_langfuse` sends anything still pending. This client
+# installs the global TracerProvider, so `flush_at` (spans per batch) and
+# `flush_interval` (seconds between exports) are what tune batching for all
+# traces, including those from the OpenAI Agents SDK.
 langfuse_client = Langfuse(
-    public_key=config.langfuse_public_key, secret_key=config.langfuse_secret_key
+    public_key=config.langfuse_public_key,
+    secret_key=config.langfuse_secret_key,
+    flush_at=100,
+    flush_interval=5.0,
 )
 
 
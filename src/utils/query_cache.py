@@ -0,0 +1,93 @@
+"""Async LRU cache with TTL expiry for repeated lookups (e.g. KB searches)."""
+
+import asyncio
+import functools
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Hashable, TypeVar
+
+
+T = TypeVar("T")
+
+
+class AsyncTTLCache:
+    """LRU cache for results of async calls, with per-entry time-to-live.
+
+    Concurrent misses on the same key are coalesced: the first caller starts
+    the computation and later callers await the same result, counted as hits.
+    Failures are propagated to every waiter and are not cached.
+    """
+
+    def __init__(self, ttl: float = 300.0, max_size: int = 2000) -> None:
+        self.ttl = ttl
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self._inflight: dict[Hashable, asyncio.Task[Any]] = {}
+        self._lock = asyncio.Lock()
+
+    async def get_or_compute(
+        self, key: Hashable, coro_factory: Callable[[], Awaitable[T]]
+    ) -> T:
+        """Return the cached value for `key`, awaiting `coro_factory()` on a miss."""
+        async with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+
+            task = self._inflight.get(key)
+            if task is None:
+                self.misses += 1
+                # Compute in a task outside the lock so that distinct keys do
+                # not serialize and a cancelled caller does not fail the others.
+                task = asyncio.ensure_future(self._compute(key, coro_factory))
+                self._inflight[key] = task
+            else:
+                self.hits += 1
+
+        return await asyncio.shield(task)
+
+    async def _compute(
+        self, key: Hashable, coro_factory: Callable[[], Awaitable[T]]
+    ) -> T:
+        """Await `coro_factory()` and store the result under `key`."""
+        try:
+            value = await coro_factory()
+            async with self._lock:
+                self._entries[key] = (time.monotonic() + self.ttl, value)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_size:
+                    self._entries.popitem(last=False)
+            return value
+        finally:
+            self._inflight.pop(key, None)
+
+    def wrap(
+        self,
+        fn: Callable[..., Awaitable[T]],
+        key_fn: Callable[..., Hashable],
+    ) -> Callable[..., Awaitable[T]]:
+        """Wrap an async function so that its results are cached.
+
+        `key_fn` receives the same arguments as `fn` and returns the cache key.
+        The wrapper keeps the signature and docstring of `fn`, so it can be
+        registered as an agent tool in place of the original.
+        """
+
+        @functools.wraps(fn)
+        async def _wrapper(*args: Any, **kwargs: Any) -> T:
+            return await self.get_or_compute(
+                key_fn(*args, **kwargs), lambda: fn(*args, **kwargs)
+            )
+
+        return _wrapper
+
+    def stats(self) -> dict[str, int]:
+        """Return hit/miss counters and current size, e.g. for trace metadata."""
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._entries)}
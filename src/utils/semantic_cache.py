@@ -0,0 +1,181 @@
+"""Semantic cache keyed on query embeddings, persisted to a local JSON file."""
+
+import json
+import logging
+import os
+import time
+from pathlib import Path
+
+import numpy as np
+import openai
+
+
+# Embeddings kept from `lookup` misses for a following `store`
+_MAX_PENDING = 64
+
+
+class SemanticCache:
+    """Cache string payloads by the meaning of the query that produced them.
+
+    Queries are embedded and compared by cosine similarity against previously
+    stored queries; a lookup hits when the best match is above a threshold.
+    Entries are scoped by an optional `namespace`, e.g. a fingerprint of the
+    documents a result was computed from, and expire after `ttl` seconds.
+    """
+
+    def __init__(
+        self,
+        path: Path | None = None,
+        max_entries: int = 1000,
+        ttl: float | None = 7 * 24 * 3600,
+        embedding_model_name: str = "@cf/baai/bge-m3",
+        embedding_api_key: str | None = None,
+        embedding_base_url: str | None = None,
+    ) -> None:
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.embedding_model_name = embedding_model_name
+        self.logger = logging.getLogger(__name__)
+
+        self._embed_client = openai.AsyncOpenAI(
+            api_key=embedding_api_key or os.getenv("EMBEDDING_API_KEY"),
+            base_url=embedding_base_url or os.getenv("EMBEDDING_BASE_URL"),
+            max_retries=5,
+        )
+
+        self._namespaces: list[str] = []
+        self._payloads: list[dict[str, str]] = []
+        self._created_at: list[float] = []
+        self._vectors = np.empty((0, 0), dtype=np.float32)
+        # Embeddings from `lookup` misses reused by a following `store`
+        self._pending: dict[str, np.ndarray] = {}
+
+        if path is not None and path.exists():
+            self._load(path)
+
+    async def lookup(
+        self, query: str, threshold: float = 0.93, namespace: str = ""
+    ) -> dict[str, str] | None:
+        """Return the payload of the most similar cached query, if any.
+
+        Parameters
+        ----------
+        query : str
+            The query to look up.
+        threshold : float, optional, default=0.93
+            Minimum cosine similarity for a cached entry to count as a hit.
+        namespace : str, optional, default=""
+            Only entries stored under the same namespace are considered.
+
+        Returns
+        -------
+        dict[str, str] | None
+            The cached payload, or None on a miss.
+        """
+        vector = await self._embed(query)
+        self._prune_expired()
+
+        if self._payloads:
+            similarities = self._vectors @ vector
+            mask = np.array([ns == namespace for ns in self._namespaces])
+            similarities = np.where(mask, similarities, -np.inf)
+            best = int(np.argmax(similarities))
+            if similarities[best] >= threshold:
+                self.logger.info(
+                    f"Semantic cache hit ({similarities[best]:.3f}): {query}"
+                )
+                return self._payloads[best]
+
+        self._pending[query] = vector
+        while len(self._pending) > _MAX_PENDING:
+            del self._pending[next(iter(self._pending))]
+        return None
+
+    async def store(
+        self, query: str, payload: dict[str, str], namespace: str = ""
+    ) -> None:
+        """Add a payload for `query` and persist the cache if a path is set."""
+        vector = self._pending.pop(query, None)
+        if vector is None:
+            vector = await self._embed(query)
+
+        self._namespaces.append(namespace)
+        self._payloads.append(payload)
+        self._created_at.append(time.time())
+        if self._vectors.size == 0:
+            self._vectors = vector[None, :]
+        else:
+            self._vectors = np.vstack([self._vectors, vector])
+
+        # Drop expired entries, then the oldest ones beyond capacity
+        self._prune_expired()
+        overflow = len(self._payloads) - self.max_entries
+        if overflow > 0:
+            self._keep(slice(overflow, None))
+
+        if self.path is not None:
+            self._save(self.path)
+
+    async def close(self) -> None:
+        """Close the embedding client."""
+        await self._embed_client.close()
+
+    async def _embed(self, text: str) -> np.ndarray:
+        """Embed text and L2-normalize it so dot products are cosine similarities."""
+        response = await self._embed_client.embeddings.create(
+            input=text, model=self.embedding_model_name
+        )
+        vector = np.asarray(response.data[0].embedding, dtype=np.float32)
+        return vector / np.linalg.norm(vector)
+
+    def _prune_expired(self) -> None:
+        """Drop entries older than `ttl`. Entries are stored oldest first."""
+        if self.ttl is None or not self._created_at:
+            return
+        cutoff = time.time() - self.ttl
+        expired = 0
+        while expired < len(self._created_at) and self._created_at[expired] < cutoff:
+            expired += 1
+        if expired:
+            self._keep(slice(expired, None))
+
+    def _keep(self, entries: slice) -> None:
+        """Keep only the given slice of entries."""
+        self._namespaces = self._namespaces[entries]
+        self._payloads = self._payloads[entries]
+        self._created_at = self._created_at[entries]
+        self._vectors = self._vectors[entries]
+
+    def _load(self, path: Path) -> None:
+        """Load entries from a JSON file written by `_save`."""
+        try:
+            entries = json.loads(path.read_text(encoding="utf-8"))
+        except (OSError, ValueError) as e:
+            self.logger.warning(f"Ignoring unreadable semantic cache {path}: {e}")
+            return
+
+        if not entries:
+            return
+        self._namespaces = [entry["namespace"] for entry in entries]
+        self._payloads = [entry["payload"] for entry in entries]
+        self._created_at = [entry.get("created_at", 0.0) for entry in entries]
+        self._vectors = np.asarray(
+            [entry["vector"] for entry in entries], dtype=np.float32
+        )
+        self._prune_expired()
+
+    def _save(self, path: Path) -> None:
+        """Write all entries to a JSON file."""
+        entries = [
+            {
+                "namespace": namespace,
+                "payload": payload,
+                "created_at": created_at,
+                "vector": vector.tolist(),
+            }
+            for namespace, payload, created_at, vector in zip(
+                self._namespaces, self._payloads, self._created_at, self._vectors
+            )
+        ]
+        path.write_text(json.dumps(entries), encoding="utf-8")
@@ -1,8 +1,10 @@
 """Implements knowledge retrieval tool for Weaviate."""
 
 import asyncio
+import contextlib
 import logging
 import os
+from typing import Any, Final
 
 import backoff
 import openai
@@ -39,6 +41,9 @@ class _SearchResult(pydantic.BaseModel):
 
 SearchResults = list[_SearchResult]
 
+DEFAULT_NUM_RESULTS: Final[int] = 5
+DEFAULT_SNIPPET_LENGTH: Final[int] = 1000
+
 
 class AsyncWeaviateKnowledgeBase:
     """Configurable search tools for Weaviate knowledge base."""
@@ -47,8 +52,8 @@ class AsyncWeaviateKnowledgeBase:
         self,
         async_client: WeaviateAsyncClient,
         collection_name: str,
-        num_results: int = 5,
-        snippet_length: int = 1000,
+        num_results: int = DEFAULT_NUM_RESULTS,
+        snippet_length: int = DEFAULT_SNIPPET_LENGTH,
         max_concurrency: int = 3,
         embedding_model_name: str = "@cf/baai/bge-m3",
         embedding_api_key: str | None = None,
@@ -92,7 +97,7 @@ class AsyncWeaviateKnowledgeBase:
             If Weaviate is not ready to accept requests (HTTP 503).
 
         """
-        async with self.async_client:
+        async with self._connection():
             if not await self.async_client.is_ready():
                 raise Exception("Weaviate is not ready to accept requests (HTTP 503).")
 
@@ -107,20 +112,51 @@ class AsyncWeaviateKnowledgeBase:
 
         self.logger.info(f"Query: {keyword}; Returned matches: {len(response.objects)}")
 
-        hits = []
+        snippet_length: int = self.snippet_length
+        results: SearchResults = []
         for obj in response.objects:
+            properties: dict[str, Any] = obj.properties
+            snippet: str = properties.get("text", "")[:snippet_length]
             hit = {
                 "_source": {
-                    "title": obj.properties.get("title", ""),
-                    "section": obj.properties.get("section", None),
-                },
-                "highlight": {
-                    "text": [obj.properties.get("text", "")[: self.snippet_length]]
+                    "title": properties.get("title", ""),
+                    "section": properties.get("section"),
                 },
+                "highlight": {"text": [snippet]},
             }
-            hits.append(hit)
+            results.append(_SearchResult.model_validate(hit))
+
+        return results
+
+    async def search_batch(self, queries: list[str]) -> list[SearchResults]:
+        """Search knowledge base with several queries concurrently.
+
+        Parameters
+        ----------
+        queries : list[str]
+            The search keywords to query the knowledge base with.
 
-        return [_SearchResult.model_validate(_hit) for _hit in hits]
+        Returns
+        -------
+        list[SearchResults]
+            One list of search results per query, in the same order as `queries`.
+        """
+        # Hold one connection across the batch so the searches share it
+        async with self._connection():
+            return list(
+                await asyncio.gather(*(self.search_knowledgebase(q) for q in queries))
+            )
+
+    def _connection(self) -> contextlib.AbstractAsyncContextManager[Any]:
+        """Reuse the caller's open connection, or open one for a single use.
+
+        Callers that run many searches can keep the client connected (e.g.
+        `async with client:`) to share one connection; otherwise each search
+        connects and closes the client itself.
+        """
+        if self.async_client.is_connected():
+            return contextlib.nullcontext()
+        return self.async_client
 
     def _vectorize(self, text: str) -> list[float]:
         """Vectorize text using the embedding client.
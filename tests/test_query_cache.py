@@ -0,0 +1,77 @@
+"""Unit tests for the async TTL cache."""
+
+import asyncio
+
+import pytest
+
+from src.utils.query_cache import AsyncTTLCache
+
+
+@pytest.mark.asyncio
+async def test_wrap_caches_by_key() -> None:
+    """Calls mapping to the same key are computed once."""
+    calls: list[str] = []
+
+    async def search(keyword: str) -> str:
+        """Search."""
+        calls.append(keyword)
+        return keyword.upper()
+
+    cache = AsyncTTLCache()
+    cached_search = cache.wrap(search, key_fn=lambda keyword: keyword.strip().lower())
+
+    assert await cached_search("Toronto") == "TORONTO"
+    assert await cached_search(keyword=" toronto ") == "TORONTO"
+    assert calls == ["Toronto"]
+    assert cache.stats() == {"hits": 1, "misses": 1, "size": 1}
+    assert cached_search.__doc__ == "Search."
+
+
+@pytest.mark.asyncio
+async def test_expired_entries_are_recomputed() -> None:
+    """Entries past their TTL are treated as misses."""
+    cache = AsyncTTLCache(ttl=0.0)
+
+    async def compute() -> int:
+        return 1
+
+    await cache.get_or_compute("key", compute)
+    await cache.get_or_compute("key", compute)
+    assert cache.misses == 2
+    assert cache.hits == 0
+
+
+@pytest.mark.asyncio
+async def test_least_recently_used_entry_is_evicted() -> None:
+    """The cache never grows beyond max_size."""
+    cache = AsyncTTLCache(max_size=2)
+
+    async def compute() -> int:
+        return 1
+
+    for key in ["a", "b", "a", "c"]:
+        await cache.get_or_compute(key, compute)
+
+    assert cache.stats()["size"] == 2
+    await cache.get_or_compute("b", compute)
+    assert cache.misses == 4
+
+
+@pytest.mark.asyncio
+async def test_concurrent_misses_are_coalesced() -> None:
+    """Concurrent calls for the same key share one computation."""
+    cache = AsyncTTLCache()
+    calls = 0
+
+    async def compute() -> int:
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return calls
+
+    results = await asyncio.gather(
+        *(cache.get_or_compute("key", compute) for _ in range(5))
+    )
+    assert results == [1] * 5
+    assert calls == 1
+    assert cache.stats() == {"hits": 4, "misses": 1, "size": 1}
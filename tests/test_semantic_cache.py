@@ -0,0 +1,95 @@
+"""Unit tests for the semantic cache, with embeddings stubbed out."""
+
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from src.utils.semantic_cache import SemanticCache
+
+
+# Unit vectors per query; "toronto" and "toronto, canada" are close (~0.995)
+VECTORS = {
+    "toronto": [1.0, 0.0, 0.0],
+    "toronto, canada": [1.0, 0.1, 0.0],
+    "vancouver": [0.0, 1.0, 0.0],
+    "montreal": [0.0, 0.0, 1.0],
+}
+
+
+def make_cache(path: Path | None = None, **kwargs) -> SemanticCache:
+    """Build a cache whose `_embed` looks vectors up in `VECTORS`."""
+    cache = SemanticCache(
+        path=path, embedding_api_key="test", embedding_base_url="http://test", **kwargs
+    )
+
+    async def embed(text: str) -> np.ndarray:
+        vector = np.asarray(VECTORS[text], dtype=np.float32)
+        return vector / np.linalg.norm(vector)
+
+    cache._embed = embed  # type: ignore[method-assign]
+    return cache
+
+
+@pytest.mark.asyncio
+async def test_lookup_respects_threshold() -> None:
+    """Similar queries hit; dissimilar ones and too-high thresholds miss."""
+    cache = make_cache()
+    await cache.store("toronto", {"advice": "a"})
+
+    assert await cache.lookup("toronto, canada") == {"advice": "a"}
+    assert await cache.lookup("toronto, canada", threshold=0.999) is None
+    assert await cache.lookup("vancouver") is None
+
+
+@pytest.mark.asyncio
+async def test_lookup_is_scoped_by_namespace() -> None:
+    """Entries stored under another namespace are never returned."""
+    cache = make_cache()
+    await cache.store("toronto", {"advice": "a"}, namespace="docs-a")
+
+    assert await cache.lookup("toronto", namespace="docs-b") is None
+    assert await cache.lookup("toronto", namespace="docs-a") == {"advice": "a"}
+
+
+@pytest.mark.asyncio
+async def test_oldest_entries_are_evicted() -> None:
+    """The cache never holds more than max_entries."""
+    cache = make_cache(max_entries=2)
+    for query in ["toronto", "vancouver", "montreal"]:
+        await cache.store(query, {"advice": query})
+
+    assert await cache.lookup("toronto") is None
+    assert await cache.lookup("montreal") == {"advice": "montreal"}
+
+
+@pytest.mark.asyncio
+async def test_expired_entries_are_ignored() -> None:
+    """Entries older than the TTL count as misses."""
+    cache = make_cache(ttl=0.0)
+    await cache.store("toronto", {"advice": "a"})
+
+    assert await cache.lookup("toronto") is None
+
+
+@pytest.mark.asyncio
+async def test_pending_embeddings_are_bounded() -> None:
+    """Hits leave nothing pending; misses are consumed by `store`."""
+    cache = make_cache()
+    await cache.store("toronto", {"advice": "a"})
+
+    await cache.lookup("toronto")
+    assert cache._pending == {}
+    await cache.lookup("vancouver")
+    await cache.store("vancouver", {"advice": "b"})
+    assert cache._pending == {}
+
+
+@pytest.mark.asyncio
+async def test_entries_survive_save_and_load(tmp_path: Path) -> None:
+    """A new cache on the same file sees previously stored entries."""
+    path = tmp_path / "cache.json"
+    await make_cache(path).store("toronto", {"advice": "a"}, namespace="docs")
+
+    reloaded = make_cache(path)
+    assert await reloaded.lookup("toronto, canada", namespace="docs") == {"advice": "a"}
@@ -47,3 +47,13 @@ async def test_weaviate_kb(weaviate_kb: AsyncWeaviateKnowledgeBase):
     responses = await weaviate_kb.search_knowledgebase("What is Toronto known for?")
     assert len(responses) > 0
     pretty_print(responses)
+
+
+@pytest.mark.asyncio
+async def test_weaviate_kb_batch(weaviate_kb: AsyncWeaviateKnowledgeBase):
+    """Test batched weaviate knowledgebase search."""
+    queries = ["What is Toronto known for?", "What is Montreal known for?"]
+    responses = await weaviate_kb.search_batch(queries)
+    assert len(responses) == len(queries)
+    assert all(len(response) > 0 for response in responses)
+    pretty_print(responses)